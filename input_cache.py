@@ -0,0 +1,149 @@
+"""
+Binary cache for the numeric text inputs shared by the pa* scripts.
+
+Every input is a first line of header numbers followed by rows of numbers.
+The first load of a file parses it in bulk and writes the rows to a binary
+cache file keyed by the input's path, size and modification time; later
+loads memory-map that file instead of parsing the text again.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 24
+BLOCK_SIZE = 1 << 16
+
+# Cache file layout: magic, row dtype (4 bytes each), number of rows,
+# number of columns, number of header values (8 bytes each), the header
+# values as int64, then the rows
+CACHE_MAGIC = b'ICAC'
+CACHE_HEADER_SIZE = 32
+
+def cache_directory():
+    return os.environ.get('ALGO2_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'algo2')
+
+def cache_path(filename, columns, dtype):
+    status = os.stat(filename)
+    path_key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16]
+    return os.path.join(cache_directory(), "{}-{}-{}-{}-{}.cache".format(
+        path_key, columns, np.dtype(dtype).str.lstrip('<>|='), status.st_size, status.st_mtime_ns))
+
+def read_chunks(filename, columns, dtype=np.int64, chunk_size=CHUNK_SIZE):
+    # Yields the header numbers, then a (rows, columns) array for every
+    # chunk of about chunk_size bytes, each cut at its last newline
+    with open(filename, 'rb') as f:
+        yield tuple(int(x) for x in f.readline().split())
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            yield parse_rows(filename, data[:end], columns, dtype)
+        if rest.strip():
+            yield parse_rows(filename, rest, columns, dtype)
+
+def parse_rows(filename, data, columns, dtype):
+    values = np.fromstring(data, dtype=dtype, sep=' ')
+    if len(values) % columns:
+        raise ValueError("{} does not have {} numbers per row".format(filename, columns))
+    return values.reshape(-1, columns)
+
+def stream_run(run, dtype, block_size=BLOCK_SIZE):
+    # Yields the records of a run file as tuples, reading a block at a time
+    run.seek(0)
+    while True:
+        block = np.fromfile(run, dtype=dtype, count=block_size)
+        if len(block) == 0:
+            return
+        yield from block.tolist()
+
+def parse_text(filename, columns, dtype, out):
+    # Writes each parsed chunk to out as soon as it is ready
+    chunks = read_chunks(filename, columns, dtype)
+    header = next(chunks)
+    num_rows = 0
+    for rows in chunks:
+        out.write(rows.tobytes())
+        num_rows += len(rows)
+    return header, num_rows
+
+def write_cache(filename, columns, dtype, path):
+    dtype = np.dtype(dtype)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as out:
+        try:
+            # The header size depends on the header values, which are only
+            # known once the first line is read, so the rows go to a second
+            # temporary file first
+            with tempfile.TemporaryFile(dir=directory) as rows:
+                header, num_rows = parse_text(filename, columns, dtype, rows)
+                out.write(CACHE_MAGIC)
+                out.write(dtype.str.encode().ljust(4))
+                out.write(num_rows.to_bytes(8, 'little'))
+                out.write(columns.to_bytes(8, 'little'))
+                out.write(len(header).to_bytes(8, 'little'))
+                out.write(np.array(header, dtype='<i8').tobytes())
+                rows.seek(0)
+                while True:
+                    data = rows.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    out.write(data)
+        except BaseException:
+            os.remove(out.name)
+            raise
+    os.replace(out.name, path)
+    # Entries for older versions of the same input are stale now
+    prefix = os.path.basename(path).split('-')[0] + '-{}-'.format(columns)
+    for entry in os.listdir(directory):
+        if entry.startswith(prefix) and entry != os.path.basename(path) and entry.endswith('.cache'):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+def read_cache(path):
+    with open(path, 'rb') as f:
+        fixed = f.read(CACHE_HEADER_SIZE)
+        if fixed[:4] != CACHE_MAGIC:
+            raise ValueError("{} is not an input cache file".format(path))
+        dtype = np.dtype(fixed[4:8].decode().strip())
+        num_rows = int.from_bytes(fixed[8:16], 'little')
+        columns = int.from_bytes(fixed[16:24], 'little')
+        header_count = int.from_bytes(fixed[24:32], 'little')
+        header = tuple(np.frombuffer(f.read(8 * header_count), dtype='<i8').tolist())
+    if num_rows == 0:
+        return header, np.empty((0, columns), dtype=dtype)
+    rows = np.memmap(path, dtype=dtype, mode='r', offset=CACHE_HEADER_SIZE + 8 * header_count,
+                     shape=(num_rows, columns))
+    return header, rows
+
+def row_width(filename):
+    # Number of values on the first row after the header
+    with open(filename, 'rb') as f:
+        f.readline()
+        return len(f.readline().split())
+
+def load_table(filename, columns=None, dtype=np.int64):
+    # Returns the header numbers and a (rows, columns) array of the rest;
+    # columns defaults to the width of the first row
+    if columns is None:
+        columns = row_width(filename)
+    path = cache_path(filename, columns, dtype)
+    if not os.path.exists(path):
+        try:
+            write_cache(filename, columns, dtype, path)
+        except OSError:
+            # No usable cache directory: parse in memory instead
+            with tempfile.TemporaryFile() as rows:
+                header, num_rows = parse_text(filename, columns, dtype, rows)
+                rows.seek(0)
+                return header, np.fromfile(rows, dtype=dtype).reshape(num_rows, columns)
+    return read_cache(path)
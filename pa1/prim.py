@@ -6,7 +6,17 @@ Implementation of Prim's algorithm for computing a minimum spanning tree of a gr
 
 import argparse
 import heapq
+import multiprocessing
+import os
 import random
+import sys
+import time
+from array import array
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import load_table
 
 class Adjacency:
     def __init__(self, node, weight):
@@ -32,20 +42,244 @@ class Graph:
         self.adjacencies[node].add(adjacency)
 
 def create_graph(filename):
-    edges = set()
-    with open(filename) as f:
-        num_nodes, num_edges = [int(x) for x in next(f).split()]
-        g = Graph(num_nodes, num_edges)
-        for line in f:
-            node1, node2, weight = [int(x) for x in line.split()]
-            adjacency1 = Adjacency(node2, weight)
-            adjacency2 = Adjacency(node1, weight)
-            g.add_node(node1)
-            g.add_node(node2)
-            g.add_adjacency(node1, adjacency1)
-            g.add_adjacency(node2, adjacency2)
+    (num_nodes, num_edges), rows = load_table(filename, 3)
+    g = Graph(num_nodes, num_edges)
+    for node1, node2, weight in rows.tolist():
+        adjacency1 = Adjacency(node2, weight)
+        adjacency2 = Adjacency(node1, weight)
+        g.add_node(node1)
+        g.add_node(node2)
+        g.add_adjacency(node1, adjacency1)
+        g.add_adjacency(node2, adjacency2)
     return g
 
+def read_edges(filename):
+    # Same input as create_graph, with nodes 1..n renumbered 0..n-1
+    (num_nodes, num_edges), rows = load_table(filename, 3)
+    tails = array('l', (rows[:, 0] - 1).tolist())
+    heads = array('l', (rows[:, 1] - 1).tolist())
+    costs = array('l', rows[:, 2].tolist())
+    return num_nodes, tails, heads, costs
+
+def create_csr_graph(filename):
+    # The neighbours of node u and the weights of the edges to them are at
+    # offsets[u]:offsets[u + 1]
+    num_nodes, tails, heads, costs = read_edges(filename)
+    degrees = [0] * (num_nodes + 1)
+    for node in tails:
+        degrees[node + 1] += 1
+    for node in heads:
+        degrees[node + 1] += 1
+    offsets = array('l', degrees)
+    for node in range(num_nodes):
+        offsets[node + 1] += offsets[node]
+    neighbours = array('l', [0]) * offsets[-1]
+    weights = array('l', [0]) * offsets[-1]
+    fill = array('l', offsets[:-1])
+    for node1, node2, weight in zip(tails, heads, costs):
+        neighbours[fill[node1]] = node2
+        weights[fill[node1]] = weight
+        fill[node1] += 1
+        neighbours[fill[node2]] = node1
+        weights[fill[node2]] = weight
+        fill[node2] += 1
+    return offsets, neighbours, weights
+
+class IndexedHeap:
+    # Binary min-heap of items 0..n-1 with one key each; position[item] is
+    # the index of item in heap (-1 once popped, -2 if never pushed)
+    def __init__(self, n):
+        self.heap = []
+        self.keys = [0] * n
+        self.position = array('l', [-2]) * n
+    def __len__(self):
+        return len(self.heap)
+    def __contains__(self, item):
+        return self.position[item] >= 0
+    def push(self, item, key):
+        self.heap.append(item)
+        self.keys[item] = key
+        self.position[item] = len(self.heap) - 1
+        self.sift_up(len(self.heap) - 1)
+    def decrease_key(self, item, key):
+        self.keys[item] = key
+        self.sift_up(self.position[item])
+    def pop(self):
+        item = self.heap[0]
+        last = self.heap.pop()
+        self.position[item] = -1
+        if self.heap:
+            self.heap[0] = last
+            self.position[last] = 0
+            self.sift_down(0)
+        return item, self.keys[item]
+    def sift_up(self, i):
+        heap, keys, position = self.heap, self.keys, self.position
+        item = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if keys[heap[parent]] <= keys[item]:
+                break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = item
+        position[item] = i
+    def sift_down(self, i):
+        heap, keys, position = self.heap, self.keys, self.position
+        n = len(heap)
+        item = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and keys[heap[child + 1]] < keys[heap[child]]:
+                child += 1
+            if keys[item] <= keys[heap[child]]:
+                break
+            heap[i] = heap[child]
+            position[heap[i]] = i
+            i = child
+        heap[i] = item
+        position[item] = i
+
+def indexed_prim(offsets, neighbours, weights):
+    n = len(offsets) - 1
+    # parent[v] is the tree node v would hang from at its current key
+    parent = array('l', [-1]) * n
+    heap = IndexedHeap(n)
+    heap.push(random.randrange(n), 0)
+    tree_weight = 0
+    tree_edges = []
+    visited = 0
+    while heap and visited < n:
+        node, key = heap.pop()
+        visited += 1
+        if parent[node] >= 0:
+            tree_weight += key
+            tree_edges.append((parent[node] + 1, node + 1, key))
+        for i in range(offsets[node], offsets[node + 1]):
+            neighbour = neighbours[i]
+            weight = weights[i]
+            position = heap.position[neighbour]
+            if position == -2:
+                parent[neighbour] = node
+                heap.push(neighbour, weight)
+            elif position >= 0 and weight < heap.keys[neighbour]:
+                parent[neighbour] = node
+                heap.decrease_key(neighbour, weight)
+    return tree_weight, tree_edges
+
+def find(parent, node):
+    # Path halving
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+def union(parent, size, node1, node2):
+    root1 = find(parent, node1)
+    root2 = find(parent, node2)
+    if root1 == root2:
+        return False
+    if size[root1] < size[root2]:
+        root1, root2 = root2, root1
+    parent[root2] = root1
+    size[root1] += size[root2]
+    return True
+
+def roots(parent):
+    # Root of every node at once, by pointer jumping
+    components = np.asarray(parent)
+    while True:
+        jumped = components[components]
+        if np.array_equal(jumped, components):
+            return components
+        components = jumped
+
+def cheapest_edges(task):
+    # Cheapest edge leaving every component touched by this chunk
+    components1, components2, costs, ids = task
+    return cheapest_per_component(np.concatenate((components1, components2)),
+                                  np.concatenate((costs, costs)),
+                                  np.concatenate((ids, ids)))
+
+def cheapest_per_component(components, costs, ids):
+    # Ties are broken by edge id so that the chosen edges never close a cycle
+    order = np.lexsort((ids, costs, components))
+    components, ids = components[order], ids[order]
+    first = np.ones(len(components), dtype=bool)
+    first[1:] = components[1:] != components[:-1]
+    return components[first], ids[first]
+
+def boruvka(num_nodes, tails, heads, costs, processes=None, chunk_size=1 << 16):
+    tails, heads, costs = np.asarray(tails), np.asarray(heads), np.asarray(costs)
+    ids = np.arange(len(costs))
+    parent = list(range(num_nodes))
+    size = [1] * num_nodes
+    tree_weight = 0
+    timings = []
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    run = pool.map if pool is not None else lambda f, tasks: list(map(f, tasks))
+    try:
+        while len(ids) > 0:
+            start = time.perf_counter()
+            components = roots(parent)
+            tasks = [(components[tails[ids[i:i + chunk_size]]], components[heads[ids[i:i + chunk_size]]],
+                      costs[ids[i:i + chunk_size]], ids[i:i + chunk_size])
+                     for i in range(0, len(ids), chunk_size)]
+            chunks = run(cheapest_edges, tasks)
+            # Combine the per-chunk winners into one winner per component
+            chunk_ids = np.concatenate([i for _, i in chunks])
+            _, best_ids = cheapest_per_component(np.concatenate([c for c, _ in chunks]),
+                                                 costs[chunk_ids], chunk_ids)
+            for edge in np.unique(best_ids).tolist():
+                if union(parent, size, tails[edge], heads[edge]):
+                    tree_weight += int(costs[edge])
+            # Contract: drop every edge inside a component
+            components = roots(parent)
+            ids = ids[components[tails[ids]] != components[heads[ids]]]
+            timings.append(("round {}".format(len(timings) + 1), time.perf_counter() - start))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return tree_weight, timings
+
+def filter_kruskal(num_nodes, tails, heads, costs, threshold=None):
+    tails, heads, costs = np.asarray(tails), np.asarray(heads), np.asarray(costs)
+    parent = list(range(num_nodes))
+    size = [1] * num_nodes
+    threshold = threshold or max(num_nodes, 1024)
+    tree_weight = 0
+    timings = []
+
+    def kruskal(ids):
+        nonlocal tree_weight
+        start = time.perf_counter()
+        for edge in ids[np.argsort(costs[ids], kind='stable')].tolist():
+            if union(parent, size, tails[edge], heads[edge]):
+                tree_weight += int(costs[edge])
+        timings.append(("batch {}".format(len(timings) + 1), time.perf_counter() - start))
+
+    def solve(ids):
+        if len(ids) <= threshold:
+            kruskal(ids)
+            return
+        pivot = costs[ids[random.randrange(len(ids))]]
+        light = costs[ids] <= pivot
+        if light.all():
+            kruskal(ids)
+            return
+        solve(ids[light])
+        # Heavy edges that now join a component with itself are never needed
+        heavy = ids[~light]
+        components = roots(parent)
+        solve(heavy[components[tails[heavy]] != components[heads[heavy]]])
+
+    solve(np.arange(len(costs)))
+    return tree_weight, timings
+
 def prim(graph):
     visited_nodes = set()
     node = random.sample(graph.nodes, 1)[0]
@@ -68,8 +302,31 @@ def prim(graph):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compute a minimum spanning tree of a graph")
     parser.add_argument('filename', type=str, help="file containing graph")
+    parser.add_argument('--algorithm', choices=['lazy', 'indexed', 'boruvka', 'filter-kruskal'], default='lazy',
+                        help="lazy: Prim with a heap entry per edge, indexed: Prim over a CSR graph with decrease-key, "
+                             "boruvka: parallel Boruvka, filter-kruskal: Kruskal filtering edges around pivots")
+    parser.add_argument('--edges', action='store_true', help="also print the tree edges (indexed only)")
+    parser.add_argument('--processes', type=int, help="number of worker processes (boruvka only)")
+    parser.add_argument('--verbose', action='store_true', help="print the time taken by each round")
     
     args = parser.parse_args()
 
-    g = create_graph(args.filename)
-    print(prim(g))
+    if args.algorithm == 'lazy':
+        g = create_graph(args.filename)
+        print(prim(g))
+    elif args.algorithm == 'indexed':
+        tree_weight, tree_edges = indexed_prim(*create_csr_graph(args.filename))
+        if args.edges:
+            for edge in tree_edges:
+                print(*edge)
+        print(tree_weight)
+    else:
+        num_nodes, tails, heads, costs = read_edges(args.filename)
+        if args.algorithm == 'boruvka':
+            tree_weight, timings = boruvka(num_nodes, tails, heads, costs, args.processes)
+        elif args.algorithm == 'filter-kruskal':
+            tree_weight, timings = filter_kruskal(num_nodes, tails, heads, costs)
+        if args.verbose:
+            for name, seconds in timings:
+                print("{}: {:.6f}s".format(name, seconds))
+        print(tree_weight)
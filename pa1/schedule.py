@@ -6,6 +6,22 @@ jobs in order to minimize the weighted sum of completion times.
 """
 
 import argparse
+import heapq
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import BLOCK_SIZE, CHUNK_SIZE, load_table, read_chunks, stream_run
+
+# Partial sums below this bound (kept well under 2**63 to absorb the
+# rounding of the float64 estimate) fit in int64
+SAFE_BOUND = 2.0**62
+
+JOB_DTYPE = np.dtype([('weight', '<i8'), ('length', '<i8')])
 
 class Job:
     def __init__(self, weight, length):
@@ -34,14 +50,12 @@ class JobRatio(Job):
 def parse_file(filename):
     job_diffs = []
     job_ratios = []
-    with open(filename) as f:
-        num_jobs = int(next(f))
-        for line in f:
-            weight, length = [int(x) for x in line.split()]
-            job_diff = JobDiff(weight, length)
-            job_ratio = JobRatio(weight, length)
-            job_diffs.append(job_diff)
-            job_ratios.append(job_ratio)
+    (num_jobs,), rows = load_table(filename, 2)
+    for weight, length in rows.tolist():
+        job_diff = JobDiff(weight, length)
+        job_ratio = JobRatio(weight, length)
+        job_diffs.append(job_diff)
+        job_ratios.append(job_ratio)
     return job_diffs, job_ratios
 
 def schedule(jobs):
@@ -53,15 +67,250 @@ def schedule(jobs):
         sum_ += job.weight * completion_time
     return sum_
 
+def as_jobs(rows):
+    # Each (weight, length) row is viewed in place as one job
+    return rows.view(JOB_DTYPE).reshape(-1)
+
+def read_job_chunks(filename, chunk_size=CHUNK_SIZE):
+    chunks = read_chunks(filename, 2, chunk_size=chunk_size)
+    num_jobs, = next(chunks)
+    for rows in chunks:
+        yield as_jobs(rows)
+
+def read_jobs(filename):
+    (num_jobs,), rows = load_table(filename, 2)
+    return as_jobs(rows)
+
+def diff_order(jobs):
+    # Decreasing weight - length, ties by decreasing weight
+    return np.lexsort((-jobs['weight'], jobs['length'] - jobs['weight']))
+
+def ratio_order(jobs):
+    # Decreasing weight / length. While weights and lengths are exact as
+    # doubles, correctly rounded division never swaps two different
+    # ratios, it can only make them equal; such runs are checked with
+    # cross-multiplied integers and re-sorted if needed. Larger values
+    # are sorted with exact integer comparisons throughout.
+    weights, lengths = jobs['weight'], jobs['length']
+    if len(jobs) == 0:
+        return np.arange(0)
+    if max(int(weights.max()), int(lengths.max())) > 2**53:
+        keys = [RatioKey(weight, length) for weight, length in zip(weights.tolist(), lengths.tolist())]
+        return np.array(sorted(range(len(jobs)), key=keys.__getitem__, reverse=True), dtype=np.intp)
+    ratios = weights / lengths
+    order = np.lexsort((-ratios,))
+    sorted_ratios = ratios[order]
+    ties = np.flatnonzero(sorted_ratios[:-1] == sorted_ratios[1:])
+    w, l = weights[order], lengths[order]
+    if int(weights.max()) * int(lengths.max()) < 2**63:
+        wrong = ties[w[ties] * l[ties + 1] < w[ties + 1] * l[ties]]
+    else:
+        wrong = np.array([i for i in ties.tolist() if int(w[i]) * int(l[i + 1]) < int(w[i + 1]) * int(l[i])], dtype=np.intp)
+    if len(wrong):
+        # Runs of equal ratios start at these positions
+        starts = np.concatenate(([0], np.flatnonzero(sorted_ratios[1:] != sorted_ratios[:-1]) + 1))
+        ends = np.append(starts[1:], len(jobs))
+        for run in np.unique(np.searchsorted(starts, wrong, side='right') - 1).tolist():
+            start, end = int(starts[run]), int(ends[run])
+            order[start:end] = sorted(order[start:end].tolist(), key=lambda job: RatioKey(weights[job], lengths[job]), reverse=True)
+    return order
+
+class RatioKey:
+    __slots__ = ('weight', 'length')
+    def __init__(self, weight, length):
+        self.weight = int(weight)
+        self.length = int(length)
+    def __lt__(self, that):
+        return self.weight * that.length < that.weight * self.length
+
+def weighted_completion_sum(jobs, offset=0):
+    # Returns the sum and the completion time of the last job. Each step
+    # takes the longest run of jobs whose int64 partial sums cannot
+    # overflow: after i jobs they are at most i * max weight * total length.
+    # A single job too large even for that is added with Python ints.
+    sum_ = 0
+    start = 0
+    while start < len(jobs):
+        block = jobs[start:start + BLOCK_SIZE]
+        weights, lengths = block['weight'], block['length']
+        bounds = (np.arange(1, len(block) + 1) * np.maximum.accumulate(weights).astype(np.float64)
+                  * np.cumsum(lengths, dtype=np.float64))
+        size = int(np.searchsorted(bounds, SAFE_BOUND))
+        if size == 0:
+            offset += int(lengths[0])
+            sum_ += int(weights[0]) * offset
+            size = 1
+        else:
+            weights, lengths = weights[:size], lengths[:size]
+            completion_times = np.cumsum(lengths)
+            sum_ += offset * int(weights.sum()) + int((weights * completion_times).sum())
+            offset += int(completion_times[-1])
+        start += size
+    return sum_, offset
+
+def vectorized_schedule(jobs):
+    diffs_sum, _ = weighted_completion_sum(jobs[diff_order(jobs)])
+    ratios_sum, _ = weighted_completion_sum(jobs[ratio_order(jobs)])
+    return diffs_sum, ratios_sum
+
+def external_schedule(filename, chunk_size=CHUNK_SIZE, directory=None):
+    # Sort every chunk both ways into run files, then merge the runs and
+    # accumulate the sums as the jobs stream past
+    diff_runs = []
+    ratio_runs = []
+    for jobs in read_job_chunks(filename, chunk_size):
+        for runs, order in ((diff_runs, diff_order), (ratio_runs, ratio_order)):
+            run = tempfile.TemporaryFile(dir=directory)
+            jobs[order(jobs)].tofile(run)
+            runs.append(run)
+    diffs_sum = merged_sum(diff_runs, lambda job: (job[1] - job[0], -job[0]))
+    ratios_sum = merged_sum(ratio_runs, lambda job: RatioKey(job[1], job[0]))
+    return diffs_sum, ratios_sum
+
+def merged_sum(runs, key):
+    try:
+        merged = heapq.merge(*[stream_run(run, JOB_DTYPE) for run in runs], key=key)
+        sum_ = 0
+        offset = 0
+        while True:
+            block = np.array([job for _, job in zip(range(BLOCK_SIZE), merged)], dtype=JOB_DTYPE)
+            if len(block) == 0:
+                return sum_
+            block_sum, offset = weighted_completion_sum(block, offset)
+            sum_ += block_sum
+    finally:
+        for run in runs:
+            run.close()
+
+class TreapNode:
+    __slots__ = ('job', 'weight', 'length', 'priority', 'left', 'right', 'weight_sum', 'length_sum')
+    def __init__(self, job, weight, length):
+        self.job = job
+        self.weight = weight
+        self.length = length
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.weight_sum = weight
+        self.length_sum = length
+    def update(self):
+        self.weight_sum = self.weight + weight_sum(self.left) + weight_sum(self.right)
+        self.length_sum = self.length + length_sum(self.left) + length_sum(self.right)
+
+def weight_sum(node):
+    return node.weight_sum if node is not None else 0
+
+def length_sum(node):
+    return node.length_sum if node is not None else 0
+
+class DynamicScheduler:
+    # Jobs are kept in schedule order in a treap whose nodes also hold the
+    # total weight and length of their subtree. Inserting job j between the
+    # jobs before and after it changes the weighted sum of completion times
+    # by w_j * (L_before + l_j) + l_j * W_after, so every update is
+    # O(log n) expected.
+    def __init__(self, order='ratio'):
+        if order == 'ratio':
+            self.before = ratio_before
+        elif order == 'diff':
+            self.before = diff_before
+        else:
+            raise ValueError("unknown order: {}".format(order))
+        self.root = None
+        self.jobs = {}
+        self.next_job = 0
+        self.sum = 0
+    def __len__(self):
+        return len(self.jobs)
+    def weighted_sum(self):
+        return self.sum
+    def add_job(self, weight, length, job=None):
+        if job is None:
+            job = self.next_job
+            self.next_job += 1
+        node = TreapNode(job, weight, length)
+        left, right = self.split(self.root, node, False)
+        self.sum += weight * (length_sum(left) + length) + length * weight_sum(right)
+        self.root = self.merge(self.merge(left, node), right)
+        self.jobs[job] = node
+        return job
+    def remove_job(self, job):
+        node = self.jobs.pop(job)
+        left, right = self.split(self.root, node, False)
+        _, right = self.split(right, node, True)
+        self.sum -= node.weight * (length_sum(left) + node.length) + node.length * weight_sum(right)
+        self.root = self.merge(left, right)
+    def update_job(self, job, weight, length):
+        self.remove_job(job)
+        self.add_job(weight, length, job)
+    def split(self, tree, node, inclusive):
+        # Jobs scheduled before node (and node itself if inclusive), and the rest
+        if tree is None:
+            return None, None
+        if self.before(tree, node) or (inclusive and tree is node):
+            left, right = self.split(tree.right, node, inclusive)
+            tree.right = left
+            tree.update()
+            return tree, right
+        left, right = self.split(tree.left, node, inclusive)
+        tree.left = right
+        tree.update()
+        return left, tree
+    def merge(self, left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self.merge(left.right, right)
+            left.update()
+            return left
+        right.left = self.merge(left, right.left)
+        right.update()
+        return right
+
+def ratio_before(a, b):
+    # Decreasing weight / length, compared by cross-multiplication
+    if a.weight * b.length != b.weight * a.length:
+        return a.weight * b.length > b.weight * a.length
+    return a.job < b.job
+
+def diff_before(a, b):
+    # Decreasing weight - length, ties by decreasing weight
+    if a.weight - a.length != b.weight - b.length:
+        return a.weight - a.length > b.weight - b.length
+    if a.weight != b.weight:
+        return a.weight > b.weight
+    return a.job < b.job
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Schedule jobs greedily")
     parser.add_argument('filename', type=str, help="file containing jobs")
+    parser.add_argument('--algorithm', choices=['objects', 'vectorized', 'external', 'dynamic'], default='objects',
+                        help="objects: sort Job objects, vectorized: sort weight and length arrays, "
+                             "external: external merge sort for files larger than memory, "
+                             "dynamic: insert the jobs one at a time into a DynamicScheduler")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="bytes of input parsed at a time (and size of each sorted run)")
 
     args = parser.parse_args()
 
-    job_diffs, job_ratios = parse_file(args.filename)
-    diffs_sum = schedule(job_diffs)
-    ratios_sum = schedule(job_ratios)
+    if args.algorithm == 'objects':
+        job_diffs, job_ratios = parse_file(args.filename)
+        diffs_sum = schedule(job_diffs)
+        ratios_sum = schedule(job_ratios)
+    elif args.algorithm == 'vectorized':
+        diffs_sum, ratios_sum = vectorized_schedule(read_jobs(args.filename))
+    elif args.algorithm == 'external':
+        diffs_sum, ratios_sum = external_schedule(args.filename, args.chunk_size)
+    elif args.algorithm == 'dynamic':
+        diffs = DynamicScheduler('diff')
+        ratios = DynamicScheduler('ratio')
+        for weight, length in read_jobs(args.filename).tolist():
+            diffs.add_job(weight, length)
+            ratios.add_job(weight, length)
+        diffs_sum = diffs.weighted_sum()
+        ratios_sum = ratios.weighted_sum()
 
     print("Weighted sum of completion times using diffs (possibly suboptimal):", diffs_sum)
     print("Weighted sum of completion times using ratios (optimal):", ratios_sum)
@@ -5,78 +5,166 @@ Implementation of an algorithm for computing a max-spacing k-clustering.
 """
 
 import argparse
+import heapq
+import os
+import sys
+import tempfile
 
-class Node:
-    def __init__(self, key):
-        self.key = key
-        self.parent = self
-        self.rank = 0
-    def __hash__(self):
-        return self.key
-    def __repr__(self):
-        return str(self.key)
-    def find(self):
-        if self != self.parent:
-            self.parent = self.parent.find()
-        return self.parent
-    def __eq__(self, that):
-        return self.key == that.key
-    def union(self, that):
-        self_root = self.find()
-        that_root = that.find()
-        if self_root == that_root:
-            return
-        if self.rank < that.rank:
-            self_root.parent = that_root
-        elif self.rank > that.rank:
-            that_root.parent = self_root
-        else:
-            that_root.parent = self_root
-            self.rank += 1
-
-class Edge:
-    def __init__(self, node1, node2, cost):
-        self.node1 = node1
-        self.node2 = node2
-        self.cost = cost
-    def __lt__(self, that):
-        return self.cost < that.cost
-    def __repr__(self):
-        return "{} {} {}".format(self.node1, self.node2, self.cost)
+import numpy as np
+
+from union_find import UnionFind
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import CHUNK_SIZE, load_table, read_chunks, stream_run
+
+# One row per merge, in the order Kruskal performs them: the merge cost,
+# the two components joined and the size of the new one. Nodes are
+# components 0..n-1 and merge i creates component n + i.
+MERGE_DTYPE = np.dtype([('cost', '<i8'), ('a', '<i4'), ('b', '<i4'), ('size', '<i4')])
+DENDROGRAM_MAGIC = b'DGRM'
+DENDROGRAM_HEADER_SIZE = 16
+
+EDGE_DTYPE = np.dtype([('node1', '<i4'), ('node2', '<i4'), ('cost', '<i8')])
+
+def as_edges(rows):
+    # Nodes 1..n are numbered 0..n-1
+    edges = np.empty(len(rows), dtype=EDGE_DTYPE)
+    edges['node1'] = rows[:, 0] - 1
+    edges['node2'] = rows[:, 1] - 1
+    edges['cost'] = rows[:, 2]
+    return edges
 
 def read_file(filename):
-    with open(filename) as f:
-        num_nodes = int(f.readline())
-        edges = []
-        key_to_node = {}
-        for line in f:
-            node1_key, node2_key, cost = [int(x) for x in line.split()]
-            if node1_key not in key_to_node.keys():
-                key_to_node[node1_key] = Node(node1_key)
-            if node2_key not in key_to_node.keys():
-                key_to_node[node2_key] = Node(node2_key)
-            edge = Edge(key_to_node[node1_key], key_to_node[node2_key], cost)
-            edges.append(edge)
-        edges.sort()
-    return key_to_node, edges
+    (num_nodes,), rows = load_table(filename, 3)
+    edges = as_edges(rows)
+    return num_nodes, edges[np.argsort(edges['cost'], kind='stable')]
+
+def stream_edges(edges, block_size=1 << 16):
+    # Hand sorted edges to Kruskal a block at a time
+    for start in range(0, len(edges), block_size):
+        yield from edges[start:start + block_size].tolist()
+
+def external_sort(filename, chunk_size=CHUNK_SIZE, directory=None):
+    # Sort every chunk into its own run file, then merge the runs lazily
+    chunks = read_chunks(filename, 3, chunk_size=chunk_size)
+    num_nodes, = next(chunks)
+    runs = []
+    for rows in chunks:
+        edges = as_edges(rows)
+        run = tempfile.TemporaryFile(dir=directory)
+        edges[np.argsort(edges['cost'], kind='stable')].tofile(run)
+        runs.append(run)
+    return num_nodes, merge_runs(runs)
+
+def merge_runs(runs):
+    try:
+        streams = [stream_run(run, EDGE_DTYPE) for run in runs]
+        for edge in heapq.merge(*streams, key=lambda edge: edge[2]):
+            yield edge
+    finally:
+        for run in runs:
+            run.close()
+
+def dendrogram(num_nodes, edges):
+    clusters = UnionFind(num_nodes)
+    component = list(range(num_nodes))
+    merges = np.zeros(max(num_nodes - 1, 0), dtype=MERGE_DTYPE)
+    merged = 0
+    for node1, node2, cost in edges:
+        root1 = clusters.find(node1)
+        root2 = clusters.find(node2)
+        if root1 == root2:
+            continue
+        clusters.union(root1, root2)
+        root = clusters.find(root1)
+        merges[merged] = (cost, component[root1], component[root2], clusters.size[root])
+        component[root] = num_nodes + merged
+        merged += 1
+        if clusters.components == 1:
+            break
+    return merges[:merged]
+
+def write_dendrogram(filename, num_nodes, merges):
+    with open(filename, 'wb') as f:
+        f.write(DENDROGRAM_MAGIC)
+        f.write(bytes(4))
+        f.write(num_nodes.to_bytes(8, 'little'))
+        f.write(merges.tobytes())
+
+def read_dendrogram(filename):
+    with open(filename, 'rb') as f:
+        header = f.read(DENDROGRAM_HEADER_SIZE)
+    if header[:4] != DENDROGRAM_MAGIC:
+        raise ValueError("{} is not a dendrogram file".format(filename))
+    num_nodes = int.from_bytes(header[8:16], 'little')
+    merges = np.memmap(filename, dtype=MERGE_DTYPE, mode='r', offset=DENDROGRAM_HEADER_SIZE)
+    return num_nodes, merges
+
+def max_spacing(num_nodes, merges, k):
+    # The merge that would take k clusters down to k - 1; with k >= n
+    # every node is its own cluster, so that is the very first merge
+    if k < 1 or num_nodes - k >= len(merges):
+        return None
+    return int(merges['cost'][max(num_nodes - k, 0)])
+
+def spacing_curve(num_nodes, merges):
+    return [(k, max_spacing(num_nodes, merges, k)) for k in range(num_nodes, num_nodes - len(merges), -1)]
+
+def cluster_labels(num_nodes, merges, k):
+    # Replay the first n - k merges; clusters are numbered 0..k-1 in order
+    # of their smallest node
+    clusters = UnionFind(num_nodes)
+    node_of = list(range(num_nodes))
+    for a, b in merges[['a', 'b']][:max(num_nodes - k, 0)].tolist():
+        clusters.union(node_of[a], node_of[b])
+        node_of.append(node_of[a])
+    numbers = {}
+    return [numbers.setdefault(clusters.find(node), len(numbers)) for node in range(num_nodes)]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compute a max-spacing k-clustering")
     parser.add_argument('filename', type=str, help="file containing graph")
     parser.add_argument('k', type=int, help="target number of clusters")
+    parser.add_argument('--save-dendrogram', type=str, metavar="DENDROGRAM",
+                        help="record every merge of one Kruskal pass to this file")
+    parser.add_argument('--dendrogram', action='store_true',
+                        help="treat filename as a saved dendrogram instead of a graph")
+    parser.add_argument('--members', action='store_true', help="also print the cluster of every node")
+    parser.add_argument('--curve', action='store_true', help="also print the max spacing for every k")
+    parser.add_argument('--external', action='store_true',
+                        help="sort the edges with an external merge sort instead of in memory")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="bytes of input parsed at a time (and size of each sorted run)")
 
     args = parser.parse_args()
 
-    key_to_node, edges = read_file(args.filename)
-    edge_key = 0
-    clusters = len(key_to_node.keys())
-    while clusters > args.k:
-        edge = edges[edge_key]
-        if edge.node1.find() != edge.node2.find():
-            edge.node1.union(edge.node2)
-            clusters -= 1
-        edge_key += 1
-    for edge in edges:
-        if edge.node1.find() != edge.node2.find():
-            print(edge.cost)
-            break
+    if args.dendrogram:
+        num_nodes, merges = read_dendrogram(args.filename)
+    elif args.external:
+        num_nodes, edges = external_sort(args.filename, args.chunk_size)
+    else:
+        num_nodes, edges = read_file(args.filename)
+        edges = stream_edges(edges)
+
+    if args.dendrogram or args.save_dendrogram or args.members or args.curve:
+        if not args.dendrogram:
+            merges = dendrogram(num_nodes, edges)
+            if args.save_dendrogram:
+                write_dendrogram(args.save_dendrogram, num_nodes, merges)
+        print(max_spacing(num_nodes, merges, args.k))
+        if args.members:
+            print(*cluster_labels(num_nodes, merges, args.k))
+        if args.curve:
+            for k, spacing in spacing_curve(num_nodes, merges):
+                print(k, spacing)
+    else:
+        clusters = UnionFind(num_nodes)
+        for node1, node2, cost in edges:
+            if clusters.components > args.k:
+                clusters.union(node1, node2)
+            elif not clusters.connected(node1, node2):
+                print(cost)
+                break
+        else:
+            # Fewer than k + 1 clusters ever exist, as in max_spacing
+            print(None)
@@ -7,103 +7,171 @@ as the Hamming distance between two nodes' labels.
 """
 
 import argparse
-import copy
-
-class Node:
-    def __init__(self, key, label):
-        self.parent = self
-        self.rank = 0
-        self.label = label
-        self.key = key
-    def __hash__(self):
-        return self.key
-    def __repr__(self):
-        return str(self.key)
-    def find(self):
-        if self != self.parent:
-            self.parent = self.parent.find()
-        return self.parent
-    def __eq__(self, that):
-        return self.key == that.key
-    def union(self, that):
-        self_root = self.find()
-        that_root = that.find()
-        if self_root == that_root:
-            return
-        if self.rank < that.rank:
-            self_root.parent = that_root
-        elif self.rank > that.rank:
-            that_root.parent = self_root
-        else:
-            that_root.parent = self_root
-            self.rank += 1
-    def hd(self, that):
-        zipped = zip(self.label, that.label)
-        z = [1 if x != y else 0 for (x, y) in zipped]
-        return sum(z)
-    def get_close_labels(self):
-        close_labels = set()
-        for i in range(24):
-            new_label = copy.copy(self.label)
-            new_label[i] = 1 - new_label[i]
-            close_labels.add(b2d(new_label))
-        for i in range(23):
-            for j in range(i+1, 24):
-                new_label = copy.copy(self.label)
-                new_label[i] = 1 - new_label[i]
-                new_label[j] = 1 - new_label[j]
-                close_labels.add(b2d(new_label))
-        return close_labels
-
-class Edge:
-    def __init__(self, node1, node2, cost):
-        self.node1 = node1
-        self.node2 = node2
-        self.cost = cost
-    def __lt__(self, that):
-        return self.cost < that.cost
-    def __repr__(self):
-        return str(self.node1) + " " + str(self.node2) + " " + str(self.cost)
-    
-def b2d(bitlist):
-    out = 0
-    for bit in bitlist:
-        out = (out << 1) | bit
-    return out
+import itertools
+import math
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from union_find import UnionFind
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import load_table
+
+MASK_BATCH_SIZE = 32
+# Every worker builds its own lookup structure: a dense table of
+# 2**label_size entries only for short labels (256 KiB at 16 bits),
+# otherwise the sorted labels probed with searchsorted
+TABLE_BITS = 16
+
+def hd(label1, label2):
+    return (label1 ^ label2).bit_count()
+
+def close_masks(label_size, distance):
+    # Every label within the given Hamming distance of x (other than x
+    # itself) is x ^ mask for one of these masks
+    masks = []
+    for d in range(1, distance + 1):
+        for bits in itertools.combinations(range(label_size), d):
+            masks.append(sum(1 << bit for bit in bits))
+    return masks
 
 def read_file(filename):
-    with open(filename) as f:
-        num_nodes, label_size = [int(x) for x in f.readline().split()]
-        key_to_node = {}
-        for line in f:
-            label = [int(x) for x in line.split()]
-            key = b2d(label)
-            node = Node(key, label)
-            key_to_node[key] = node
-    return num_nodes, key_to_node
+    # Labels are packed into integers; nodes sharing a label are merged
+    # straight away, so every label appears once
+    (num_nodes, label_size), bits = load_table(filename, dtype=np.int8)
+    if label_size < 64:
+        packed = np.zeros(len(bits), dtype=np.int64)
+        for column in range(label_size):
+            packed = (packed << 1) | bits[:, column]
+        labels = packed.tolist()
+    else:
+        labels = [int(''.join(map(str, row)), 2) for row in bits.tolist()]
+    label_to_index = {}
+    for label in labels:
+        label_to_index.setdefault(label, len(label_to_index))
+    return num_nodes, label_size, label_to_index
+
+def cluster_by_masks(label_to_index, label_size, radius, clusters, verbose=False):
+    masks = close_masks(label_size, radius)
+    for label, index in label_to_index.items():
+        if verbose:
+            if index % 1000 == 0: print("Iteration:", index)
+        for mask in masks:
+            other = label_to_index.get(label ^ mask)
+            if other is not None:
+                clusters.union(index, other)
+
+def substrings(label_size, parts):
+    # (shift, mask) of each of `parts` contiguous substrings of a label,
+    # as even in width as possible
+    fields = []
+    shift = 0
+    for part in range(parts):
+        width = (label_size + part) // parts
+        fields.append((shift, (1 << width) - 1))
+        shift += width
+    return fields
+
+def cluster_by_multi_index(label_to_index, label_size, radius, clusters, verbose=False):
+    # Two labels within distance radius agree exactly on at least one of
+    # radius + 1 substrings, so only labels sharing a bucket are compared
+    fields = substrings(label_size, radius + 1)
+    tables = [{} for _ in fields]
+    for label in label_to_index:
+        for (shift, mask), table in zip(fields, tables):
+            table.setdefault((label >> shift) & mask, []).append(label)
+    for label, index in label_to_index.items():
+        if verbose:
+            if index % 1000 == 0: print("Iteration:", index)
+        for (shift, mask), table in zip(fields, tables):
+            for other in table[(label >> shift) & mask]:
+                if other > label and hd(label, other) <= radius:
+                    clusters.union(index, label_to_index[other])
+
+batch_labels = None
+
+def init_batch_worker(labels, label_size):
+    global batch_labels
+    if label_size <= TABLE_BITS:
+        # Direct lookup table: table[label] is the index of label, or -1
+        table = np.full(1 << label_size, -1, dtype=np.int32)
+        table[labels.astype(np.int64)] = np.arange(len(labels), dtype=np.int32)
+        batch_labels = (labels, table, None)
+    else:
+        order = np.argsort(labels)
+        batch_labels = (labels, labels[order], order)
+
+def close_pairs(masks):
+    # Index pairs (i, j) with i < j and labels[j] == labels[i] ^ mask for
+    # some mask
+    labels, lookup, order = batch_labels
+    indices = np.arange(len(labels))
+    firsts = []
+    seconds = []
+    for mask in masks:
+        targets = labels ^ mask
+        if order is None:
+            matches = lookup[targets.astype(np.int64)]
+        else:
+            positions = np.searchsorted(lookup, targets)
+            positions[positions == len(labels)] = 0
+            matches = np.where(lookup[positions] == targets, order[positions], -1)
+        hits = np.flatnonzero(matches > indices)
+        firsts.append(hits)
+        seconds.append(matches[hits])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def cluster_vectorized(label_to_index, label_size, radius, clusters, processes=None, verbose=False):
+    if label_size > 64:
+        raise ValueError("vectorized clustering supports labels of at most 64 bits")
+    labels = np.fromiter(label_to_index, dtype=np.uint64, count=len(label_to_index))
+    masks = np.array(close_masks(label_size, radius), dtype=np.uint64)
+    batches = [masks[i:i + MASK_BATCH_SIZE] for i in range(0, len(masks), MASK_BATCH_SIZE)]
+    if processes == 1:
+        init_batch_worker(labels, label_size)
+        results = map(close_pairs, batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initializer=init_batch_worker, initargs=(labels, label_size))
+        results = pool.imap_unordered(close_pairs, batches)
+    try:
+        for batch, (firsts, seconds) in enumerate(results):
+            if verbose: print("Mask batch:", batch)
+            clusters.union_many(firsts.tolist(), seconds.tolist())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compute a max-spacing k-clustering")
     parser.add_argument('filename', type=str, help="file containing graph")
+    parser.add_argument('--radius', type=int, default=2, help="merge nodes whose labels are at most this far apart")
+    parser.add_argument('--method', choices=['auto', 'masks', 'multi-index', 'vectorized'], default='auto',
+                        help="masks: probe every label within the radius, "
+                             "multi-index: compare labels sharing a substring, "
+                             "vectorized: probe all labels per mask with NumPy, "
+                             "auto: masks unless there are more masks than labels")
+    parser.add_argument('--processes', type=int, help="number of worker processes (vectorized only)")
     parser.add_argument('--verbose', action='store_true', help="print additional messages")
 
     args = parser.parse_args()
 
-    num_nodes, key_to_node = read_file(args.filename)
-    it = 0
-
-    for node in key_to_node.values():
-        if args.verbose:
-            it += 1
-            if it % 1000 == 0: print("Iteration:", it)
-        close_labels = node.get_close_labels()
-        for key in close_labels:
-            if key in key_to_node.keys():
-                node.union(key_to_node[key])
-    
-    reps = set()
-
-    for node in key_to_node.values():
-        reps.add(node.find().key)
+    num_nodes, label_size, label_to_index = read_file(args.filename)
+    clusters = UnionFind(len(label_to_index))
+    method = args.method
+    if method == 'auto':
+        num_masks = sum(math.comb(label_size, d) for d in range(1, args.radius + 1))
+        method = 'masks' if num_masks <= len(label_to_index) else 'multi-index'
+        if args.verbose: print("Using", method)
+    if method == 'masks':
+        cluster_by_masks(label_to_index, label_size, args.radius, clusters, args.verbose)
+    elif method == 'multi-index':
+        cluster_by_multi_index(label_to_index, label_size, args.radius, clusters, args.verbose)
+    elif method == 'vectorized':
+        cluster_vectorized(label_to_index, label_size, args.radius, clusters, args.processes, args.verbose)
 
-    print(len(reps))
+    print(clusters.components)
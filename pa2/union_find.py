@@ -0,0 +1,39 @@
+"""
+Array-backed disjoint-set (union-find) structure shared by the clustering scripts.
+"""
+
+from array import array
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = array('i', range(n))
+        self.size = array('i', [1]) * n
+        self.components = n
+    def __len__(self):
+        return len(self.parent)
+    def find(self, x):
+        parent = self.parent
+        # Path halving: point every other node on the path to its grandparent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    def connected(self, x, y):
+        return self.find(x) == self.find(y)
+    def union(self, x, y):
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return False
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        self.components -= 1
+        return True
+    def union_many(self, xs, ys):
+        merged = 0
+        for x, y in zip(xs, ys):
+            if self.union(x, y):
+                merged += 1
+        return merged
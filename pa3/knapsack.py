@@ -6,8 +6,19 @@ for solving the 0/1 Knapsack Problem.
 """
 
 import argparse
+import bisect
+import os
 import sys
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import load_table
+
+INFINITY = float('inf')
+
+verbose = False
+
 class Item:
     def __init__(self, key, value, weight):
         self.key = key
@@ -19,15 +30,10 @@ class Item:
         return str(self.value) + " " + str(self.weight)
 
 def read_data(filename):
-    with open(filename) as f:
-        knapsack_size, number_of_items = [int(x) for x in f.readline().split()]
-        items = {}
-        key = 0
-        for line in f:
-            value, weight = [int(x) for x in line.split()]
-            item = Item(key, value, weight)
-            items[key] = item
-            key += 1
+    (knapsack_size, number_of_items), rows = load_table(filename, 2)
+    items = {}
+    for key, (value, weight) in enumerate(rows.tolist()):
+        items[key] = Item(key, value, weight)
     return knapsack_size, number_of_items, items
 
 class Knapsack:
@@ -36,36 +42,57 @@ class Knapsack:
         self.number_of_items = number_of_items
         self.items = items
         self.m = {}
+        self.row = None
     def top_down_solve(self, size, item_key):
-        sys.setrecursionlimit(10000)
-
-        if item_key <= 0:
-            return 0
-        
-        if item_key in self.m.keys() and size in self.m[item_key].keys():
-            return self.m[item_key][size]
-
-        if item_key not in self.m.keys():
-            self.m[item_key] = {}
-        item = self.items[item_key]
-
-        if item.weight > size:
-            self.m[item_key][size] = self.top_down_solve(size, item_key - 1)
-        else:
-            self.m[item_key][size] = max(self.top_down_solve(size, item_key - 1),
-                                         self.top_down_solve(size - item.weight, item_key - 1) + item.value)
+        global verbose
+        # Pareto frontier of (weight, value) states: weights and values are
+        # both strictly increasing, so every dominated partial solution is
+        # dropped as soon as it appears.
+        weights = [0]
+        values = [0]
+        for key in range(item_key + 1):
+            if verbose:
+                if key % 100 == 0: print("Solving for item =", key, "- frontier size:", len(weights))
+            item = self.items[key]
+            if item.weight > size:
+                continue
+            new_weights = []
+            new_values = []
+            i = j = 0
+            n = len(weights)
+            best = -1
+            while i < n or j < n:
+                if j >= n or (i < n and weights[i] <= weights[j] + item.weight):
+                    weight, value = weights[i], values[i]
+                    i += 1
+                else:
+                    weight, value = weights[j] + item.weight, values[j] + item.value
+                    j += 1
+                    if weight > size:
+                        j = n
+                        continue
+                if value <= best:
+                    continue
+                if new_weights and new_weights[-1] == weight:
+                    new_values[-1] = value
+                else:
+                    new_weights.append(weight)
+                    new_values.append(value)
+                best = value
+            weights = new_weights
+            values = new_values
+        return values[-1]
 
-        return self.m[item_key][size]
-        
     def bottom_up_solve(self):
         global verbose
-        self.m[0] = {}
+        # Row -1 (no items yet) is all zeros, so every item from 0 on counts
+        self.m[-1] = {}
         for x in range(self.knapsack_size + 1):
-            self.m[0][x] = 0
+            self.m[-1][x] = 0
         for size in range(self.knapsack_size + 1):
             if verbose:
                 if size % 1000 == 0: print("Solving for size =", size, "...")
-            for item_key in range(1, self.number_of_items):
+            for item_key in range(self.number_of_items):
                 item = self.items[item_key]
                 if item_key not in self.m.keys():
                     self.m[item_key] = {}
@@ -76,13 +103,156 @@ class Knapsack:
                                                  self.m[item_key - 1][size - item.weight] + item.value)
         return self.m[self.number_of_items - 1][self.knapsack_size]
 
+    def best_row(self, item_keys, size, row=None):
+        global verbose
+        # row[x] is the best value achievable with capacity x
+        if row is None:
+            row = np.zeros(size + 1, dtype=np.int64)
+        for item_key in item_keys:
+            if verbose:
+                if item_key % 100 == 0: print("Solving for item =", item_key, "...")
+            item = self.items[item_key]
+            if item.weight > size:
+                continue
+            if item.weight == 0:
+                row += item.value
+                continue
+            candidate = row[:size + 1 - item.weight] + item.value
+            np.maximum(row[item.weight:], candidate, out=row[item.weight:])
+        return row
+
+    def solve_row(self, size):
+        # The last row answers every capacity up to its length, so it is
+        # kept around and only recomputed for a larger capacity. Like every
+        # other solver it uses all items 0..number_of_items - 1.
+        if self.row is None or len(self.row) < size + 1:
+            self.row = self.best_row(range(self.number_of_items), size)
+        return self.row
+
+    def solve_capacities(self, capacities):
+        if min(capacities) < 0:
+            raise ValueError("capacities must be non-negative")
+        row = self.solve_row(max(capacities))
+        return [int(row[capacity]) for capacity in capacities]
+
+    def add_item(self, value, weight):
+        item = Item(self.number_of_items, value, weight)
+        self.items[item.key] = item
+        self.number_of_items += 1
+        if self.row is not None:
+            self.best_row([item.key], len(self.row) - 1, self.row)
+        return item
+
+    def vectorized_solve(self, reconstruct=False):
+        value = self.solve_capacities([self.knapsack_size])[0]
+        if not reconstruct:
+            return value
+        chosen = self.reconstruct(list(range(self.number_of_items)), self.knapsack_size)
+        return value, sorted(chosen)
+
+    def reconstruct(self, item_keys, size):
+        # Divide and conquer: split the items in two halves, find how the
+        # capacity is shared between them and recurse, keeping only O(size)
+        # values alive at any time.
+        if not item_keys:
+            return []
+        if len(item_keys) == 1:
+            item = self.items[item_keys[0]]
+            if item.weight <= size and item.value > 0:
+                return [item.key]
+            return []
+        middle = len(item_keys) // 2
+        first, second = item_keys[:middle], item_keys[middle:]
+        first_row = self.best_row(first, size)
+        second_row = self.best_row(second, size)
+        split = int(np.argmax(first_row + second_row[::-1]))
+        del first_row, second_row
+        return self.reconstruct(first, split) + self.reconstruct(second, size - split)
+
+    def branch_and_bound_solve(self, core=None):
+        items = sorted(self.items.values(),
+                       key=lambda item: item.value / item.weight if item.weight > 0 else INFINITY,
+                       reverse=True)
+        size = self.knapsack_size
+        value = 0
+        # Items before the break item all fit in the greedy solution
+        break_key = 0
+        weight = 0
+        while break_key < len(items) and weight + items[break_key].weight <= size:
+            weight += items[break_key].weight
+            break_key += 1
+        if core is not None:
+            # Fix everything well before the break item in, everything
+            # well after it out, and only branch over the core
+            first = max(0, break_key - core)
+            last = min(len(items), break_key + core + 1)
+            for item in items[:first]:
+                size -= item.weight
+                value += item.value
+            items = items[first:last]
+        best, stats = branch_and_bound(items, size)
+        stats['root_bound'] += value
+        stats['greedy'] += value
+        stats['core'] = len(items)
+        return best + value, stats
+
+def branch_and_bound(items, size):
+    n = len(items)
+    values = [item.value for item in items]
+    weights = [item.weight for item in items]
+    prefix_values = [0]
+    prefix_weights = [0]
+    for item in items:
+        prefix_values.append(prefix_values[-1] + item.value)
+        prefix_weights.append(prefix_weights[-1] + item.weight)
+
+    def dantzig_bound(i, size, value):
+        # Greedy fractional relaxation over items i..n-1
+        b = bisect.bisect_right(prefix_weights, prefix_weights[i] + size, i) - 1
+        value += prefix_values[b] - prefix_values[i]
+        if b < n:
+            size -= prefix_weights[b] - prefix_weights[i]
+            value += size * values[b] // weights[b]
+        return value
+
+    # The greedy solution is a good starting incumbent
+    best = 0
+    remaining = size
+    for i in range(n):
+        if weights[i] <= remaining:
+            remaining -= weights[i]
+            best += values[i]
+
+    stats = {'nodes': 0, 'pruned': 0, 'root_bound': dantzig_bound(0, size, 0), 'greedy': best}
+    stack = [(0, size, 0)]
+    while stack:
+        i, size, value = stack.pop()
+        stats['nodes'] += 1
+        if value > best:
+            best = value
+        if i == n:
+            continue
+        if dantzig_bound(i, size, value) <= best:
+            stats['pruned'] += 1
+            continue
+        stack.append((i + 1, size, value))
+        if weights[i] <= size:
+            stack.append((i + 1, size - weights[i], value + values[i]))
+    return best, stats
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Solve the 0/1 Knapsack Problem")
     parser.add_argument('filename', type=str, help="file containing items")
-    parser.add_argument('algorithm', metavar="algorithm", type=int, choices=range(0, 2), help="0: top-down, 1: bottom-up")
+    parser.add_argument('algorithm', metavar="algorithm", type=int, choices=range(0, 4),
+                        help="0: top-down, 1: bottom-up, 2: vectorized bottom-up, 3: branch-and-bound")
+    parser.add_argument('--items', action='store_true', help="also print the chosen items (algorithm 2 only)")
+    parser.add_argument('--core', type=int, help="only branch over this many items on each side of the break item (algorithm 3 only, may be suboptimal)")
+    parser.add_argument('--capacities', type=int, nargs='+', help="also print the best value for each of these capacities")
     parser.add_argument('--verbose', action='store_true', help="print additional messages")
 
     args = parser.parse_args()
+    if args.capacities and min(args.capacities) < 0:
+        parser.error("capacities must be non-negative")
 
     verbose = args.verbose
     knapsack_size, number_of_items, items = read_data(args.filename)
@@ -91,4 +261,18 @@ if __name__ == "__main__":
         solution = k.top_down_solve(knapsack_size, number_of_items - 1)
     elif args.algorithm == 1:
         solution = k.bottom_up_solve()
+    elif args.algorithm == 2:
+        if args.items:
+            solution, chosen = k.vectorized_solve(reconstruct=True)
+            print(*chosen)
+        else:
+            solution = k.vectorized_solve()
+    elif args.algorithm == 3:
+        solution, stats = k.branch_and_bound_solve(args.core)
+        if verbose:
+            for name, value in stats.items():
+                print(name + ":", value)
     print(solution)
+    if args.capacities:
+        for capacity, value in zip(args.capacities, k.solve_capacities(args.capacities)):
+            print(capacity, value)
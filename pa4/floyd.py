@@ -6,18 +6,28 @@ for solving the all-pairs shortest-path problem.
 """
 
 import argparse
+import heapq
+import multiprocessing
+import os
+import sys
+from array import array
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import load_table
 
 INFINITY = float('inf')
 
+verbose = False
+
 def read_file(filename):
-    with open(filename) as f:
-        num_vertices, num_edges = [int(x) for x in f.readline().split()]
-        tail_to_head = {}
-        for vertex in range(1, num_vertices + 1):
-            tail_to_head[vertex] = {}
-        for line in f:
-            tail, head, length = [int(x) for x in line.split()]
-            tail_to_head[tail][head] = length
+    (num_vertices, num_edges), rows = load_table(filename, 3)
+    tail_to_head = {}
+    for vertex in range(1, num_vertices + 1):
+        tail_to_head[vertex] = {}
+    for tail, head, length in rows.tolist():
+        tail_to_head[tail][head] = length
     return num_vertices, num_edges, tail_to_head
 
 def floyd_warshall(n, tail_to_head):
@@ -53,13 +63,295 @@ def floyd_warshall(n, tail_to_head):
 
     return shortest_path_length
 
+def sentinel(dtype):
+    # Largest value that cannot overflow when two of them are added
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).max // 4
+    return np.inf
+
+def infinity_bound(dtype):
+    # Negative lengths can pull "infinite" entries below the sentinel, but
+    # never below half of it
+    if np.issubdtype(dtype, np.integer):
+        return sentinel(dtype) // 2
+    return np.inf
+
+def distance_matrix(n, tail_to_head, dtype=np.int64):
+    a = np.full((n, n), sentinel(dtype), dtype=dtype)
+    for tail, heads in tail_to_head.items():
+        for head, length in heads.items():
+            a[tail - 1, head - 1] = length
+    np.fill_diagonal(a, 0)
+    return a
+
+def relax_all(a, next_hop=None):
+    # Floyd-Warshall in place; False as soon as a negative cycle shows up
+    global verbose
+    diagonal = a.diagonal()
+    bound = infinity_bound(a.dtype)
+    for k in range(len(a)):
+        if verbose and k % 100 == 0: print("Iteration:", k)
+        candidate = a[:, k, None] + a[None, k, :]
+        if next_hop is None:
+            np.minimum(a, candidate, out=a)
+        else:
+            # Only paths through k that actually exist may set a next hop
+            reachable = (a[:, k, None] < bound) & (a[None, k, :] < bound)
+            improved = reachable & (candidate < a)
+            np.copyto(a, candidate, where=improved)
+            np.copyto(next_hop, next_hop[:, k, None], where=improved)
+        # A negative diagonal entry means a negative cycle: stop right away
+        if diagonal.min() < 0:
+            return False
+    return True
+
+def vectorized_floyd_warshall(n, tail_to_head, dtype=np.int64, filename=None):
+    if filename is None:
+        a = distance_matrix(n, tail_to_head, dtype)
+        return int(a.min()) if relax_all(a) else None
+
+    a, next_hop = create_result_file(filename, n, dtype)
+    a[:] = distance_matrix(n, tail_to_head, dtype)
+    next_hop[:] = np.where(a < sentinel(dtype), np.arange(n, dtype=np.int32), -1)
+    if not relax_all(a, next_hop):
+        del a, next_hop
+        os.remove(filename)
+        return None
+    a.flush()
+    next_hop.flush()
+    return int(a.min())
+
+class DynamicShortestPaths:
+    # All-pairs distances kept up to date under edge updates. Inserting or
+    # shortening an edge (u, v) relaxes every pair through it in O(n^2);
+    # lengthening or deleting it recomputes only the sources whose shortest
+    # path to v used it. A new negative cycle must pass through the changed
+    # edge, so it is caught by checking the path back from v to u.
+    # An already solved distance matrix for tail_to_head, such as the one
+    # open_result_file maps from a --save file, can be passed as `a` to
+    # skip the initial solve. Updates are written into `a`, so a read-only
+    # mapping is copied into memory first.
+    def __init__(self, n, tail_to_head, dtype=np.int64, a=None):
+        self.n = n
+        self.tail_to_head = {tail: dict(heads) for tail, heads in tail_to_head.items()}
+        if a is None:
+            self.dtype = np.dtype(dtype)
+            self.recompute()
+        else:
+            self.dtype = a.dtype
+            self.a = a if a.flags.writeable else np.array(a)
+            self.negative_cycle = bool(self.a.diagonal().min() < 0)
+    def recompute(self):
+        self.a = distance_matrix(self.n, self.tail_to_head, self.dtype)
+        self.negative_cycle = not relax_all(self.a)
+    def infinite(self, length):
+        return length >= infinity_bound(self.dtype)
+    def shortest_path_length(self):
+        return None if self.negative_cycle else int(self.a.min())
+    def dist(self, u, v):
+        if self.negative_cycle:
+            return None
+        length = self.a[u - 1, v - 1]
+        return INFINITY if self.infinite(length) else length.item()
+    def set_edge(self, u, v, length):
+        old = self.tail_to_head[u].get(v, INFINITY)
+        self.tail_to_head[u][v] = length
+        if self.negative_cycle:
+            # Distances are meaningless until the cycle is gone
+            self.recompute()
+        elif length < old:
+            self.decrease(u - 1, v - 1, length)
+        elif length > old:
+            self.increase(u - 1, v - 1, old)
+        return not self.negative_cycle
+    def remove_edge(self, u, v):
+        old = self.tail_to_head[u].pop(v)
+        if self.negative_cycle:
+            self.recompute()
+        else:
+            self.increase(u - 1, v - 1, old)
+        return not self.negative_cycle
+    def decrease(self, u, v, length):
+        a = self.a
+        if not self.infinite(a[v, u]) and a[v, u] + length < 0:
+            self.negative_cycle = True
+            return
+        np.minimum(a, a[:, u, None] + length + a[None, v, :], out=a)
+    def increase(self, u, v, old):
+        a = self.a
+        column = a[:, u]
+        affected = np.flatnonzero((column + old == a[:, v]) & ~self.infinite(column))
+        if len(affected) == 0:
+            return
+        a[affected] = sentinel(self.dtype)
+        a[affected, affected] = 0
+        # Bellman-Ford over whole rows: d(s, .) = min over edges (s, x) of
+        # length(s, x) + d(x, .), starting from the rows that did not change
+        heads = [np.array([head - 1 for head in self.tail_to_head[s + 1]], dtype=np.int64) for s in affected]
+        lengths = [np.array(list(self.tail_to_head[s + 1].values()), dtype=self.dtype) for s in affected]
+        changed = True
+        while changed:
+            changed = False
+            for s, s_heads, s_lengths in zip(affected, heads, lengths):
+                if len(s_heads) == 0:
+                    continue
+                row = np.minimum(a[s], (s_lengths[:, None] + a[s_heads]).min(axis=0))
+                row[s] = 0
+                if not np.array_equal(row, a[s]):
+                    a[s] = row
+                    changed = True
+
+# Result file layout: magic, distance dtype (4 bytes each), n (8 bytes),
+# then the n x n distance matrix and the n x n int32 next-hop matrix
+RESULT_MAGIC = b'APSP'
+RESULT_HEADER_SIZE = 16
+
+def create_result_file(filename, n, dtype):
+    dtype = np.dtype(dtype)
+    with open(filename, 'wb') as f:
+        f.write(RESULT_MAGIC)
+        f.write(dtype.str.encode().ljust(4))
+        f.write(n.to_bytes(8, 'little'))
+        f.truncate(RESULT_HEADER_SIZE + n * n * (dtype.itemsize + 4))
+    return open_result_file(filename, 'r+')
+
+def open_result_file(filename, mode='r'):
+    with open(filename, 'rb') as f:
+        header = f.read(RESULT_HEADER_SIZE)
+    if header[:4] != RESULT_MAGIC:
+        raise ValueError("{} is not a shortest-path result file".format(filename))
+    dtype = np.dtype(header[4:8].decode().strip())
+    n = int.from_bytes(header[8:16], 'little')
+    a = np.memmap(filename, dtype=dtype, mode=mode, offset=RESULT_HEADER_SIZE, shape=(n, n))
+    next_hop = np.memmap(filename, dtype=np.int32, mode=mode,
+                         offset=RESULT_HEADER_SIZE + n * n * dtype.itemsize, shape=(n, n))
+    return a, next_hop
+
+# Answers queries from a saved result file; only the pages touched by a
+# query are ever read from disk
+class ShortestPaths:
+    def __init__(self, filename):
+        self.filename = filename
+        self.a = None
+        self.next_hop = None
+    def open(self):
+        if self.a is None:
+            self.a, self.next_hop = open_result_file(self.filename)
+            self.infinity = infinity_bound(self.a.dtype)
+    def dist(self, u, v):
+        self.open()
+        length = self.a[u - 1, v - 1]
+        if length >= self.infinity:
+            return INFINITY
+        return length.item()
+    def path(self, u, v):
+        if self.dist(u, v) == INFINITY or self.next_hop[u - 1, v - 1] < 0:
+            return None
+        path = [u]
+        while u != v:
+            u = int(self.next_hop[u - 1, v - 1]) + 1
+            path.append(u)
+        return path
+
+def csr_graph(n, tail_to_head):
+    # Vertices are renumbered 0..n-1; the heads of vertex u are
+    # heads[offsets[u]:offsets[u + 1]]
+    offsets = array('q', [0])
+    heads = array('q')
+    lengths = array('q')
+    for tail in range(1, n + 1):
+        for head, length in tail_to_head[tail].items():
+            heads.append(head - 1)
+            lengths.append(length)
+        offsets.append(len(heads))
+    return offsets, heads, lengths
+
+def bellman_ford_potentials(n, offsets, heads, lengths):
+    global verbose
+    # Distances from a virtual source joined to every vertex by a 0-length
+    # edge, so every potential starts at 0
+    tails = np.repeat(np.arange(n), np.diff(np.frombuffer(offsets, dtype=np.int64)))
+    heads = np.frombuffer(heads, dtype=np.int64)
+    lengths = np.frombuffer(lengths, dtype=np.int64)
+    h = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        if verbose and i % 100 == 0: print("Bellman-Ford iteration:", i)
+        new_h = h.copy()
+        np.minimum.at(new_h, heads, h[tails] + lengths)
+        if np.array_equal(new_h, h):
+            return h
+        h = new_h
+    # Still relaxing after n rounds: negative cycle
+    return None
+
+worker_graph = None
+
+def init_worker(graph):
+    global worker_graph
+    worker_graph = graph
+
+def dijkstra_min(source):
+    # Shortest path from source to any vertex (itself included) under the
+    # original lengths, computed on the reweighted non-negative lengths
+    offsets, heads, lengths, h = worker_graph
+    n = len(h)
+    dist = [INFINITY] * n
+    dist[source] = 0
+    heap = [(0, source)]
+    shortest = 0
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        shortest = min(shortest, d + h[u] - h[source])
+        for i in range(offsets[u], offsets[u + 1]):
+            v = heads[i]
+            new_d = d + lengths[i]
+            if new_d < dist[v]:
+                dist[v] = new_d
+                heapq.heappush(heap, (new_d, v))
+    return shortest
+
+def johnson(n, tail_to_head, processes=None):
+    offsets, heads, lengths = csr_graph(n, tail_to_head)
+    h = bellman_ford_potentials(n, offsets, heads, lengths)
+    if h is None:
+        return None
+    h = array('q', h.tolist())
+    reweighted = array('q', (lengths[i] + h[u] - h[heads[i]]
+                             for u in range(n)
+                             for i in range(offsets[u], offsets[u + 1])))
+    graph = (offsets, heads, reweighted, h)
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(graph,)) as pool:
+        return min(pool.imap_unordered(dijkstra_min, range(n), chunksize=16))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Solve the all-pairs shortest-path problem")
     parser.add_argument('filename', type=str, help="file containing graph")
+    parser.add_argument('--algorithm', choices=['naive', 'vectorized', 'johnson'], default='naive',
+                        help="naive: dict-based Floyd-Warshall, vectorized: NumPy Floyd-Warshall, "
+                             "johnson: Johnson's algorithm with parallel Dijkstra")
+    parser.add_argument('--dtype', choices=['int32', 'int64', 'float64'], default='int64',
+                        help="element type of the distance matrix (vectorized only)")
+    parser.add_argument('--processes', type=int, help="number of worker processes (johnson only)")
+    parser.add_argument('--save', type=str, metavar="RESULT",
+                        help="write distances and next hops to this file (vectorized only)")
+    parser.add_argument('--query', type=int, nargs=2, action='append', metavar=("U", "V"),
+                        help="treat filename as a saved result and print the distance and path from U to V")
     parser.add_argument('--verbose', action='store_true', help="print additional messages")
 
     args = parser.parse_args()
 
     verbose = args.verbose
-    num_vertices, num_edges, tail_to_head = read_file(args.filename)
-    print(floyd_warshall(num_vertices, tail_to_head))
+    if args.query:
+        shortest_paths = ShortestPaths(args.filename)
+        for u, v in args.query:
+            print(shortest_paths.dist(u, v), shortest_paths.path(u, v))
+    else:
+        num_vertices, num_edges, tail_to_head = read_file(args.filename)
+        if args.algorithm == 'naive':
+            print(floyd_warshall(num_vertices, tail_to_head))
+        elif args.algorithm == 'vectorized':
+            print(vectorized_floyd_warshall(num_vertices, tail_to_head, np.dtype(args.dtype), args.save))
+        elif args.algorithm == 'johnson':
+            print(johnson(num_vertices, tail_to_head, args.processes))
@@ -9,9 +9,17 @@ import argparse
 import copy
 import itertools
 import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
 
 INFINITY = float('inf')
 
+verbose = False
+
+CHUNK_SIZE = 1 << 12
+
 class City:
     def __init__(self, key, x, y):
         self.key = key
@@ -65,14 +73,347 @@ def tsp(n, cities):
     best_value = min([new[index + j] + cities[j].distance(cities[1]) for j in range(2, n + 1)])
     return best_value
 
+def distance_matrix(n, cities):
+    # Row and column i hold city i + 1
+    x = np.array([cities[key].x for key in range(1, n + 1)])
+    y = np.array([cities[key].y for key in range(1, n + 1)])
+    return np.sqrt((x[:, None] - x[None, :])**2 + (y[:, None] - y[None, :])**2)
+
+def popcount_layers(bits):
+    # All subsets of `bits` elements grouped by size: layer m holds the
+    # masks order[starts[m]:starts[m + 1]] in increasing order, and
+    # position[mask] is the index of mask within its layer. Both fit in
+    # int32 and are filled one layer at a time to keep temporaries small.
+    sizes = np.bitwise_count(np.arange(1 << bits, dtype=np.int32))
+    starts = np.concatenate(([0], np.cumsum(np.bincount(sizes, minlength=bits + 1))))
+    order = np.empty(1 << bits, dtype=np.int32)
+    position = np.empty(1 << bits, dtype=np.int32)
+    for m in range(bits + 1):
+        layer = np.flatnonzero(sizes == m)
+        order[starts[m]:starts[m + 1]] = layer
+        position[layer] = np.arange(len(layer), dtype=np.int32)
+    del sizes
+    return order, starts, position
+
+def held_karp(n, cities, upper_bound=None):
+    global verbose
+    if n == 1:
+        return 0
+    d = distance_matrix(n, cities)
+    # City 1 is fixed as the start; bit j of a mask stands for city j + 2
+    others = n - 1
+    order, starts, position = popcount_layers(others)
+    bits = 1 << np.arange(others)
+
+    # old[position[S], j]: shortest path from city 1 visiting exactly S and
+    # ending at j (infinite when j is not in S)
+    old = np.full((others, others), INFINITY)
+    old[position[bits], np.arange(others)] = d[0, 1:]
+
+    if upper_bound is not None:
+        # Each remaining edge is at least half the cost of the cheapest
+        # edges at its ends: two for every unvisited city, one for the
+        # current endpoint and one for city 1
+        nearest = np.sort(np.where(np.eye(n, dtype=bool), INFINITY, d), axis=1)[:, :2]
+        pair = nearest.sum(axis=1) / 2
+        limit = upper_bound * (1 + 1e-9) - pair[1:].sum() - nearest[0, 0] / 2
+        endpoint = nearest[1:, 0] / 2
+
+    for m in range(2, others + 1):
+        if verbose: print("Solving for", m + 1, "cities...")
+        new = np.full((starts[m + 1] - starts[m], others), INFINITY)
+        previous_layer = order[starts[m - 1]:starts[m]]
+        for chunk in range(0, len(previous_layer), CHUNK_SIZE):
+            masks = previous_layer[chunk:chunk + CHUNK_SIZE]
+            block = old[chunk:chunk + CHUNK_SIZE]
+            if upper_bound is not None:
+                # Drop partial tours that cannot beat the upper bound
+                visited = ((masks[:, None] & bits) != 0) @ pair[1:]
+                block = np.where(block + endpoint - visited[:, None] > limit, INFINITY, block)
+                alive = np.isfinite(block).any(axis=1)
+                masks, block = masks[alive], block[alive]
+            # best[r, j]: cheapest way to extend masks[r] with city j, as a
+            # min-plus product of the chunk with the distance matrix
+            best = block[:, 0, None] + d[1, 1:]
+            for k in range(1, others):
+                np.minimum(best, block[:, k, None] + d[k + 1, 1:], out=best)
+            rows, j = np.nonzero((masks[:, None] & bits) == 0)
+            new[position[masks[rows] | bits[j]], j] = best[rows, j]
+        old = new
+
+    return float((old[0] + d[1:, 0]).min())
+
+def binomial_table(n):
+    # binomial[b, k] == C(b, k), zero when k > b
+    binomial = np.zeros((n + 1, n + 2), dtype=np.int64)
+    binomial[:, 0] = 1
+    for b in range(1, n + 1):
+        binomial[b, 1:] = binomial[b - 1, 1:] + binomial[b - 1, :-1]
+    return binomial
+
+def subset_rank(masks, bits, binomial):
+    # Combinatorial number system: the t-th smallest element c of the
+    # subset contributes C(c, t), which numbers the subsets of each size
+    # 0, 1, 2, ... in increasing mask order
+    rank = np.zeros(masks.shape, dtype=np.int64)
+    count = np.zeros(masks.shape, dtype=np.int64)
+    for b in range(bits):
+        present = (masks >> b) & 1
+        count += present
+        rank += present * binomial[b, count]
+    return rank
+
+def subset_unrank(ranks, m, bits, binomial):
+    masks = np.zeros(ranks.shape, dtype=np.int64)
+    remaining = ranks.copy()
+    k = np.full(ranks.shape, m, dtype=np.int64)
+    for b in reversed(range(bits)):
+        c = binomial[b, k]
+        take = (k > 0) & (remaining >= c)
+        masks |= take.astype(np.int64) << b
+        remaining -= np.where(take, c, 0)
+        k -= take
+    return masks
+
+layer_worker = None
+
+def init_layer_worker(names, d):
+    global layer_worker
+    buffers = [shared_memory.SharedMemory(name=name) for name in names]
+    others = len(d) - 1
+    layer_worker = (buffers, d, binomial_table(others))
+
+def extend_layer(task):
+    # Push every subset with rank in [low, high) of layer m - 1 into layer
+    # m; each entry of layer m has a single predecessor, so tasks never
+    # write to the same place
+    m, low, high, source = task
+    buffers, d, binomial = layer_worker
+    others = len(d) - 1
+    old = np.ndarray((binomial[others, m - 1], others), buffer=buffers[source].buf)
+    new = np.ndarray((binomial[others, m], others), buffer=buffers[1 - source].buf)
+    bits = 1 << np.arange(others)
+
+    masks = subset_unrank(np.arange(low, high), m - 1, others, binomial)
+    block = old[low:high]
+    best = block[:, 0, None] + d[1, 1:]
+    for k in range(1, others):
+        np.minimum(best, block[:, k, None] + d[k + 1, 1:], out=best)
+    rows, j = np.nonzero((masks[:, None] & bits) == 0)
+    new[subset_rank(masks[rows] | bits[j], others, binomial), j] = best[rows, j]
+
+def layered_held_karp(n, cities, processes=None):
+    global verbose
+    if n == 1:
+        return 0
+    d = distance_matrix(n, cities)
+    others = n - 1
+    binomial = binomial_table(others)
+
+    # Only two layers are alive at a time; they take turns in two shared
+    # buffers sized for the largest layer
+    size = int(binomial[others].max()) * others * d.itemsize
+    buffers = [shared_memory.SharedMemory(create=True, size=size) for _ in range(2)]
+    names = [buffer.name for buffer in buffers]
+    pool = None
+    try:
+        old = np.ndarray((others, others), buffer=buffers[0].buf)
+        old[:] = INFINITY
+        old[np.arange(others), np.arange(others)] = d[0, 1:]
+        if processes == 1:
+            init_layer_worker(names, d)
+            run = map
+        else:
+            pool = multiprocessing.Pool(processes, initializer=init_layer_worker, initargs=(names, d))
+            run = pool.imap_unordered
+        source = 0
+        new = None
+        for m in range(2, others + 1):
+            if verbose: print("Solving for", m + 1, "cities...")
+            new = np.ndarray((binomial[others, m], others), buffer=buffers[1 - source].buf)
+            new[:] = INFINITY
+            count = binomial[others, m - 1]
+            tasks = [(m, low, min(low + CHUNK_SIZE, count), source)
+                     for low in range(0, count, CHUNK_SIZE)]
+            for _ in run(extend_layer, tasks):
+                pass
+            source = 1 - source
+        if pool is not None:
+            pool.close()
+            pool.join()
+        old = np.ndarray((1, others), buffer=buffers[source].buf)
+        best_value = float((old[0] + d[1:, 0]).min())
+        del old, new
+    finally:
+        # Workers must be gone before the buffers they attach to are
+        # unlinked, also when a task failed or the run was interrupted
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for buffer in buffers:
+            buffer.close()
+            buffer.unlink()
+    return best_value
+
+def neighbour_lists(points, k):
+    # k nearest neighbours of every point, found by searching square rings
+    # of cells around it in a uniform grid
+    n = len(points)
+    k = min(k, n - 1)
+    xs = [x for x, y in points]
+    ys = [y for x, y in points]
+    width = max(max(xs) - min(xs), max(ys) - min(ys)) or 1
+    cell = width / max(1, math.isqrt(n // 2))
+    grid = {}
+    for i, (x, y) in enumerate(points):
+        grid.setdefault((int(x // cell), int(y // cell)), []).append(i)
+    neighbours = []
+    for i, (x, y) in enumerate(points):
+        cx, cy = int(x // cell), int(y // cell)
+        candidates = []
+        ring = 0
+        while True:
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) == ring:
+                        candidates.extend(j for j in grid.get((gx, gy), ()) if j != i)
+            # Points outside the searched rings are at least ring * cell away
+            if len(candidates) >= k:
+                candidates.sort(key=lambda j: math.dist(points[i], points[j]))
+                if math.dist(points[i], points[candidates[k - 1]]) <= ring * cell:
+                    break
+            ring += 1
+        neighbours.append(candidates[:k])
+    return neighbours
+
+def tour_length(tour, points):
+    return sum(math.dist(points[a], points[b]) for a, b in zip(tour, tour[1:] + tour[:1]))
+
+def nearest_neighbour_tour(points, neighbours):
+    unvisited = set(range(1, len(points)))
+    tour = [0]
+    while unvisited:
+        last = tour[-1]
+        city = next((j for j in neighbours[last] if j in unvisited), None)
+        if city is None:
+            city = min(unvisited, key=lambda j: math.dist(points[last], points[j]))
+        unvisited.remove(city)
+        tour.append(city)
+    return tour
+
+def two_opt(tour, points, neighbours):
+    n = len(tour)
+    position = [0] * n
+    for i, city in enumerate(tour):
+        position[city] = i
+    improved = False
+    for i in range(n):
+        for direction in (1, -1):
+            a = tour[i]
+            b = tour[(position[a] + direction) % n]
+            d_ab = math.dist(points[a], points[b])
+            for c in neighbours[a]:
+                d_ac = math.dist(points[a], points[c])
+                if d_ac >= d_ab:
+                    break
+                d = tour[(position[c] + direction) % n]
+                if c == b or d == a:
+                    continue
+                delta = d_ac + math.dist(points[b], points[d]) - d_ab - math.dist(points[c], points[d])
+                if delta < -1e-9:
+                    # Replace edges (a, b) and (c, d) by (a, c) and (b, d) by
+                    # reversing b..c (or d..a going backwards), or the
+                    # complementary segment if that is shorter
+                    if direction == 1:
+                        low, high = position[a] + 1, position[c]
+                    else:
+                        low, high = position[a], position[c] - 1
+                    if ((high - low) % n + 1) * 2 > n:
+                        low, high = high + 1, low - 1
+                    for step in range(((high - low) % n + 1) // 2):
+                        x, y = (low + step) % n, (high - step) % n
+                        tour[x], tour[y] = tour[y], tour[x]
+                        position[tour[x]], position[tour[y]] = x, y
+                    improved = True
+                    b = tour[(position[a] + direction) % n]
+                    d_ab = math.dist(points[a], points[b])
+    return improved
+
+def or_opt(tour, points, neighbours):
+    # Move segments of up to three cities between two neighbouring cities
+    n = len(tour)
+    improved = False
+    for length in (1, 2, 3):
+        i = 0
+        while i < n:
+            segment = [tour[(i + step) % n] for step in range(length)]
+            before, after = tour[(i - 1) % n], tour[(i + length) % n]
+            first, last = segment[0], segment[-1]
+            gain = (math.dist(points[before], points[first]) + math.dist(points[last], points[after])
+                    - math.dist(points[before], points[after]))
+            move = None
+            for end in (first, last):
+                for c in neighbours[end]:
+                    if c in segment or c == before:
+                        continue
+                    e = tour[(tour.index(c) + 1) % n]
+                    if e in segment:
+                        continue
+                    d_ce = math.dist(points[c], points[e])
+                    forward = math.dist(points[c], points[first]) + math.dist(points[last], points[e]) - d_ce
+                    backward = math.dist(points[c], points[last]) + math.dist(points[first], points[e]) - d_ce
+                    if forward < gain - 1e-9 and (move is None or forward < move[0]):
+                        move = (forward, c, segment)
+                    if backward < gain - 1e-9 and (move is None or backward < move[0]):
+                        move = (backward, c, segment[::-1])
+            if move is None:
+                i += 1
+                continue
+            _, c, inserted = move
+            rest = [city for city in tour if city not in segment]
+            at = rest.index(c) + 1
+            tour[:] = rest[:at] + inserted + rest[at:]
+            improved = True
+    return improved
+
+def heuristic_tsp(n, cities, k=10):
+    global verbose
+    points = [(cities[key].x, cities[key].y) for key in range(1, n + 1)]
+    if n <= 3:
+        tour = list(range(n))
+    else:
+        neighbours = neighbour_lists(points, k)
+        tour = nearest_neighbour_tour(points, neighbours)
+        if verbose: print("Nearest neighbour tour:", tour_length(tour, points))
+        while two_opt(tour, points, neighbours) | or_opt(tour, points, neighbours):
+            if verbose: print("Improved tour:", tour_length(tour, points))
+        start = tour.index(0)
+        tour = tour[start:] + tour[:start]
+    return [city + 1 for city in tour], tour_length(tour, points)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Solve the Travelling Salesman Problem")
     parser.add_argument('filename', type=str, help="file containing cities")
+    parser.add_argument('--algorithm', choices=['naive', 'bitmask', 'layered', 'heuristic'], default='naive',
+                        help="naive: dict-based DP, bitmask: array-backed Held-Karp, "
+                             "layered: two-layer Held-Karp over worker processes, "
+                             "heuristic: nearest neighbour tour improved by 2-opt and Or-opt")
+    parser.add_argument('--processes', type=int, help="number of worker processes (layered only)")
     parser.add_argument('--verbose', action='store_true', help="print additional messages")
 
     args = parser.parse_args()
     
     num_cities, cities = read_file(args.filename)
     verbose = args.verbose
-    min_cost_tour = tsp(num_cities, cities)
+    if args.algorithm == 'naive':
+        min_cost_tour = tsp(num_cities, cities)
+    elif args.algorithm == 'bitmask':
+        tour, upper_bound = heuristic_tsp(num_cities, cities)
+        if verbose: print("Upper bound from heuristic tour:", upper_bound)
+        min_cost_tour = held_karp(num_cities, cities, upper_bound)
+    elif args.algorithm == 'layered':
+        min_cost_tour = layered_held_karp(num_cities, cities, args.processes)
+    elif args.algorithm == 'heuristic':
+        tour, min_cost_tour = heuristic_tsp(num_cities, cities)
+        print(*tour)
     print(min_cost_tour)
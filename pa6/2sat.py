@@ -5,6 +5,15 @@ Implementation of an algorithm for solving the 2-SAT problem.
 """
 
 import argparse
+import os
+import sys
+from array import array
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from input_cache import load_table
 
 class Vertex:
     def __init__(self, value):
@@ -54,7 +63,7 @@ class Kosaraju:
             if self.visited[n] == 1:
                 stack.append(n)
                 self.visited[n] = 2
-                for head in g.tail_to_head[n]:
+                for head in self.g.tail_to_head[n]:
                     if head not in self.visited.keys():
                         self.visited[head] = 1
                         stack.append(head)
@@ -70,7 +79,7 @@ class Kosaraju:
             if self.s not in self.leader_to_vertices.keys():
                 self.leader_to_vertices[self.s] = set()
             self.leader_to_vertices[self.s].add(vertex)
-            for head in g.tail_to_head[vertex]:
+            for head in self.g.tail_to_head[vertex]:
                 if head not in self.visited:
                     stack.append(head)
     def first_loop(self):
@@ -104,28 +113,298 @@ class Kosaraju:
                     return False
         return True
 
-def parse_data(filename):
-    with open(filename) as f:
-        n = int(next(f))
-        edges = []
-        s = set()
-        for line in f:
-            x, y = [int(i) for i in line.split()]
-            edge1 = [-x, y]
-            edge2 = [-y, x]
-            edges.append(edge1)
-            edges.append(edge2)
+def parse_clauses(filename):
+    (n,), rows = load_table(filename, 2)
+    clauses = [(x, y) for x, y in rows.tolist()]
+    return n, clauses
+
+def clause_edges(clauses):
+    # Clause (x or y) gives implications -x -> y and -y -> x
+    edges = []
+    for x, y in clauses:
+        edge1 = [-x, y]
+        edge2 = [-y, x]
+        edges.append(edge1)
+        edges.append(edge2)
     return edges
 
+def parse_data(filename):
+    n, clauses = parse_clauses(filename)
+    return clause_edges(clauses)
+
+def literal_index(literals):
+    # Literal x becomes 2(x - 1) and -x becomes 2(x - 1) + 1, so a literal
+    # and its negation differ only in the lowest bit
+    literals = np.asarray(literals, dtype=np.int64)
+    return 2 * (np.abs(literals) - 1) + (literals < 0)
+
+def csr_graph(num_vertices, tails, heads):
+    order = np.argsort(tails, kind='stable')
+    offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=num_vertices), out=offsets[1:])
+    return offsets, heads[order]
+
+def implication_graph(edges, num_variables=None):
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if num_variables is None:
+        num_variables = int(np.abs(edges).max()) if len(edges) else 0
+    tails = literal_index(edges[:, 0])
+    heads = literal_index(edges[:, 1])
+    return num_variables, csr_graph(2 * num_variables, tails, heads)
+
+def tarjan(offsets, heads):
+    # Iterative Tarjan; components are numbered in reverse topological
+    # order of the condensation (sinks first)
+    n = len(offsets) - 1
+    offsets = array('l', offsets.tolist())
+    heads = array('l', heads.tolist())
+    index = array('l', [-1]) * n
+    low = array('l', [0]) * n
+    on_stack = bytearray(n)
+    next_edge = array('l', offsets[:-1])
+    component = array('l', [-1]) * n
+    stack = []
+    counter = 0
+    components = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [root]
+        while work:
+            v = work[-1]
+            edge = next_edge[v]
+            if edge < offsets[v + 1]:
+                next_edge[v] = edge + 1
+                w = heads[edge]
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    work.append(w)
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            work.pop()
+            if work and low[v] < low[work[-1]]:
+                low[work[-1]] = low[v]
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = 0
+                    component[w] = components
+                    if w == v:
+                        break
+                components += 1
+    return np.frombuffer(component, dtype=np.dtype('l'))
+
+def scc_solve(edges, num_variables=None):
+    num_variables, (offsets, heads) = implication_graph(edges, num_variables)
+    component = tarjan(offsets, heads)
+    positive, negative = component[0::2], component[1::2]
+    if np.any(positive == negative):
+        return False, None
+    # A literal is true when its component comes after its negation's in
+    # topological order, i.e. has the smaller Tarjan number
+    return True, (positive < negative).tolist()
+
+def preprocess(clauses):
+    # Repeatedly drop tautologies and duplicates, satisfy pure literals and
+    # propagate unit clauses (x or x). Every literal set true is logged so
+    # the full assignment can be rebuilt; returns None for the clauses when
+    # a conflict shows the instance is unsatisfiable. A pure literal that
+    # no longer occurs anywhere is skipped, leaving its variable free.
+    stats = {'clauses': len(clauses), 'tautologies': 0, 'duplicates': 0, 'pure': 0, 'units': 0, 'removed': 0}
+    live = {}
+    for x, y in clauses:
+        if x == -y:
+            stats['tautologies'] += 1
+            continue
+        key = (x, y) if x <= y else (y, x)
+        if key in live:
+            stats['duplicates'] += 1
+            continue
+        live[key] = True
+    occurrences = {}
+    for clause in live:
+        for literal in set(clause):
+            occurrences.setdefault(literal, set()).add(clause)
+
+    value = {}
+    log = []
+    # Pending units always go before pure literals, which are only safe
+    # once nothing forces the opposite value. Pure literals are taken in
+    # order of first occurrence, so an early one can satisfy the clauses
+    # of later ones before they are fixed.
+    units = [x for x, y in live if x == y]
+    pure = deque(literal for literal in occurrences if -literal not in occurrences)
+
+    def remove(clause):
+        del live[clause]
+        stats['removed'] += 1
+        for literal in set(clause):
+            occurrences[literal].discard(clause)
+            if not occurrences[literal]:
+                del occurrences[literal]
+                # With no occurrences left, the negation may have become pure
+                if -literal in occurrences and abs(literal) not in value:
+                    pure.append(-literal)
+
+    while units or pure:
+        if units:
+            literal, reason = units.pop(), 'units'
+        else:
+            literal, reason = pure.popleft(), 'pure'
+        variable = abs(literal)
+        if variable in value:
+            if reason == 'units' and value[variable] != (literal > 0):
+                return None, log, stats
+            continue
+        if reason == 'pure' and (literal not in occurrences or -literal in occurrences):
+            continue
+        value[variable] = literal > 0
+        log.append(literal)
+        stats[reason] += 1
+        for clause in list(occurrences.get(literal, ())):
+            remove(clause)
+        for clause in list(occurrences.get(-literal, ())):
+            # The clause now hinges on its other literal
+            other = clause[1] if clause[0] == -literal else clause[0]
+            remove(clause)
+            units.append(other)
+
+    stats['remaining'] = len(live)
+    return list(live), log, stats
+
+def preprocessed_solve(clauses, num_variables):
+    reduced, log, stats = preprocess(clauses)
+    if reduced is None:
+        return False, None, stats
+    satisfiable, assignment = scc_solve(clause_edges(reduced), num_variables)
+    if not satisfiable:
+        return False, None, stats
+    # Variables fixed by preprocessing no longer occur in the reduced
+    # clauses, so their logged values can simply be laid on top
+    for literal in log:
+        assignment[abs(literal) - 1] = literal > 0
+    return True, assignment, stats
+
+class IncrementalSolver:
+    # Keeps a model of every clause added so far. A new clause that the
+    # model violates is repaired by setting one of its literals true and
+    # flipping only the literals that this forces and that are currently
+    # false; if neither literal can be set without reaching a literal and
+    # its negation, the clauses are unsatisfiable.
+    def __init__(self):
+        self.implications = {}
+        self.value = {}
+        self.clauses = []
+        self.num_variables = 0
+        self.satisfiable = True
+        self.trail = []
+        self.checkpoints = []
+    def is_true(self, literal):
+        return self.value.get(abs(literal), False) == (literal > 0)
+    def add_clause(self, x, y):
+        self.clauses.append((x, y))
+        self.implications.setdefault(-x, []).append(y)
+        self.implications.setdefault(-y, []).append(x)
+        self.num_variables = max(self.num_variables, abs(x), abs(y))
+        if not self.satisfiable:
+            return False
+        if self.is_true(x) or self.is_true(y):
+            return True
+        for literal in (x, y):
+            flipped = self.propagate(literal)
+            if flipped is not None:
+                for forced in flipped:
+                    self.assign(forced)
+                return True
+        self.satisfiable = False
+        return False
+    def propagate(self, literal):
+        # Literals that must be flipped to make literal true, or None if
+        # that leads to a contradiction
+        reached = {literal}
+        stack = [literal]
+        while stack:
+            for implied in self.implications.get(stack.pop(), ()):
+                if implied in reached:
+                    continue
+                if -implied in reached:
+                    return None
+                reached.add(implied)
+                if not self.is_true(implied):
+                    stack.append(implied)
+        return [literal for literal in reached if not self.is_true(literal)]
+    def assign(self, literal):
+        variable = abs(literal)
+        if self.checkpoints:
+            self.trail.append((variable, self.value.get(variable)))
+        self.value[variable] = literal > 0
+    def is_satisfiable(self):
+        return self.satisfiable
+    def model(self):
+        if not self.satisfiable:
+            return None
+        return [self.value.get(variable, False) for variable in range(1, self.num_variables + 1)]
+    def push(self):
+        self.checkpoints.append((len(self.clauses), len(self.trail), self.num_variables, self.satisfiable))
+    def pop(self):
+        num_clauses, trail_length, self.num_variables, self.satisfiable = self.checkpoints.pop()
+        while len(self.clauses) > num_clauses:
+            x, y = self.clauses.pop()
+            self.implications[-y].pop()
+            self.implications[-x].pop()
+        while len(self.trail) > trail_length:
+            variable, value = self.trail.pop()
+            if value is None:
+                del self.value[variable]
+            else:
+                self.value[variable] = value
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
     parser.add_argument('filename', type=str, help="file containing edges")
+    parser.add_argument('--algorithm', choices=['kosaraju', 'tarjan', 'incremental'], default='kosaraju',
+                        help="kosaraju: Kosaraju over sets of vertices, tarjan: iterative Tarjan over CSR arrays, "
+                             "incremental: add the clauses one at a time, repairing a model as it goes")
+    parser.add_argument('--assignment', action='store_true',
+                        help="also print a satisfying assignment as true literals (tarjan and incremental only)")
+    parser.add_argument('--preprocess', action='store_true',
+                        help="shrink the instance with pure literals and unit propagation first (tarjan only)")
+    parser.add_argument('--verbose', action='store_true', help="print preprocessing statistics")
     
     args = parser.parse_args()
 
-    edges = parse_data(args.filename)
-    g = Graph()
-    g.parse_edge_list(edges)
-    k = Kosaraju(g)
-    k.run()
-    print(k.check())
+    if args.algorithm == 'kosaraju':
+        edges = parse_data(args.filename)
+        g = Graph()
+        g.parse_edge_list(edges)
+        k = Kosaraju(g)
+        k.run()
+        print(k.check())
+    elif args.algorithm == 'tarjan':
+        n, clauses = parse_clauses(args.filename)
+        if args.preprocess:
+            satisfiable, assignment, stats = preprocessed_solve(clauses, n)
+            if args.verbose:
+                for name, count in stats.items():
+                    print(name + ":", count)
+        else:
+            satisfiable, assignment = scc_solve(clause_edges(clauses), n)
+        print(satisfiable)
+    elif args.algorithm == 'incremental':
+        n, clauses = parse_clauses(args.filename)
+        solver = IncrementalSolver()
+        for x, y in clauses:
+            if not solver.add_clause(x, y):
+                break
+        satisfiable, assignment = solver.is_satisfiable(), solver.model()
+        print(satisfiable)
+    if args.algorithm != 'kosaraju' and args.assignment and satisfiable:
+        print(*[x if value else -x for x, value in enumerate(assignment, 1)])